@@ -0,0 +1,237 @@
+import typing
+import abc
+import json
+import csv
+import io
+import os
+import base64
+import mimetypes
+import html
+import argparse
+import pickle
+
+from oracles import *
+from workspaces import WorkspaceManager
+
+IMAGES_NONE = None
+IMAGES_COPY = "copy"
+IMAGES_EMBED = "embed"
+
+
+class Exporter(abc.ABC):
+    extension = ""
+
+    def __init__(self, images: str = IMAGES_NONE, images_dir: str = None) -> None:
+        self.images = images
+        self.images_dir = images_dir
+        self.base_dir = ""
+
+    def header(self, title: str) -> typing.Iterator[str]:
+        return iter(())
+
+    def footer(self) -> typing.Iterator[str]:
+        return iter(())
+
+    def recordHeader(self, record: Record) -> typing.Iterator[str]:
+        return iter(())
+
+    @abc.abstractmethod
+    def row(self, row: dict) -> typing.Iterator[str]:
+        pass
+
+    def valueRow(self, record: Record, value: Value) -> dict:
+        return {
+            "record": record.name,
+            "oracle": value.oracle.getName(),
+            "id": str(value.id),
+            "name": str(value.getName()),
+            "state": value.state or "",
+            "meaning": value.getMeaning(),
+            "description": value.getDesc(),
+            "image": self.resolveImage(value),
+        }
+
+    def resolveImage(self, value: Value) -> str:
+        image = value.getImage()
+        if not self.images or not image:
+            return image
+        # images of pack oracles only exist inside the pack file
+        data = value.getImageData()
+        if data is None:
+            return image
+        if self.images == IMAGES_EMBED:
+            mime = mimetypes.guess_type(image)[0] or "application/octet-stream"
+            return "data:{};base64,{}".format(mime, base64.b64encode(data).decode("ascii"))
+        if self.images == IMAGES_COPY and self.images_dir:
+            # keep the source layout, different oracles reuse the same file names
+            target = os.path.join(self.images_dir, os.path.normpath(image).replace("..", "_"))
+            if not os.path.isfile(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as f:
+                    f.write(data)
+            return os.path.relpath(target, self.base_dir or ".")
+        return image
+
+    def iterValues(self, record: Record) -> typing.Iterator[str]:
+        # copy the list so a record changed from the UI can't break the iteration
+        for value in list(record.values):
+            yield from self.row(self.valueRow(record, value))
+
+    def iterRecord(self, record: Record) -> typing.Iterator[str]:
+        yield from self.header(record.name)
+        yield from self.iterValues(record)
+        yield from self.footer()
+
+    def iterWorkspace(self, workspace: Workspace) -> typing.Iterator[str]:
+        yield from self.header(workspace.name)
+        for record in list(workspace.records):
+            yield from self.recordHeader(record)
+            yield from self.iterValues(record)
+        yield from self.footer()
+
+    def iterExport(self, target) -> typing.Iterator[str]:
+        if isinstance(target, Workspace):
+            return self.iterWorkspace(target)
+        return self.iterRecord(target)
+
+    def export(self, target, filename: str) -> None:
+        if self.images == IMAGES_COPY and not self.images_dir:
+            self.images_dir = os.path.splitext(filename)[0] + "_images"
+        self.base_dir = os.path.dirname(os.path.abspath(filename))
+        with open(filename, "w", encoding="utf-8", newline="") as f:
+            for chunk in self.iterExport(target):
+                f.write(chunk)
+
+
+class JSONLExporter(Exporter):
+    extension = ".jsonl"
+
+    def row(self, row: dict) -> typing.Iterator[str]:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+class CSVExporter(Exporter):
+    extension = ".csv"
+    fields = ["record", "oracle", "id", "name", "state", "meaning", "description", "image"]
+
+    def __init__(self, images: str = IMAGES_NONE, images_dir: str = None) -> None:
+        super().__init__(images, images_dir)
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=self.fields)
+
+    def flush(self) -> str:
+        chunk = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return chunk
+
+    def header(self, title: str) -> typing.Iterator[str]:
+        self.writer.writeheader()
+        yield self.flush()
+
+    def row(self, row: dict) -> typing.Iterator[str]:
+        self.writer.writerow(row)
+        yield self.flush()
+
+
+class MarkdownExporter(Exporter):
+    extension = ".md"
+
+    def header(self, title: str) -> typing.Iterator[str]:
+        yield "# {}\n\n".format(title)
+
+    def recordHeader(self, record: Record) -> typing.Iterator[str]:
+        yield "## {}\n\n".format(record.name)
+
+    def row(self, row: dict) -> typing.Iterator[str]:
+        title = "### {}: {}".format(row["oracle"], row["name"])
+        if row["state"]:
+            title += " [**{}**]".format(row["state"])
+        yield title + "\n\n"
+        if row["image"]:
+            yield "![{}]({})\n\n".format(row["name"], row["image"].replace(" ", "%20"))
+        if row["meaning"]:
+            yield "{}\n\n".format(row["meaning"])
+        if row["description"]:
+            yield "> {}\n\n".format(row["description"])
+
+
+class HTMLExporter(Exporter):
+    extension = ".html"
+
+    def header(self, title: str) -> typing.Iterator[str]:
+        yield "<!DOCTYPE html>\n<html>\n<head>\n<meta charset='utf-8'>\n<title>{}</title>\n</head>\n<body>\n".format(html.escape(title))
+        yield "<h1>{}</h1>\n".format(html.escape(title))
+
+    def footer(self) -> typing.Iterator[str]:
+        yield "</body>\n</html>\n"
+
+    def recordHeader(self, record: Record) -> typing.Iterator[str]:
+        yield "<h2>{}</h2>\n".format(html.escape(record.name))
+
+    def row(self, row: dict) -> typing.Iterator[str]:
+        yield "<div style='border: 1px solid darkgrey; padding: 6px; margin: 6px 0'>\n"
+        if row["image"]:
+            yield "<img src='{}' alt='{}' style='height: 150px; float: left; margin-right: 12px'>\n".format(
+                html.escape(row["image"], quote=True), html.escape(row["name"], quote=True))
+        title = "<b>{}</b>: {}".format(html.escape(row["oracle"]), html.escape(row["name"]))
+        if row["state"]:
+            title += " [<b>{}</b>]".format(html.escape(row["state"]))
+        yield "<p style='font-size: 18px'>{}</p>\n".format(title)
+        if row["meaning"]:
+            yield "<p>{}</p>\n".format(html.escape(row["meaning"]))
+        if row["description"]:
+            yield "<p><i>{}</i></p>\n".format(html.escape(row["description"]))
+        yield "<div style='clear: both'></div>\n</div>\n"
+
+
+exporters = {
+    "jsonl": JSONLExporter,
+    "csv": CSVExporter,
+    "md": MarkdownExporter,
+    "html": HTMLExporter,
+}
+
+
+def exporterForFile(filename: str, images: str = IMAGES_NONE, images_dir: str = None) -> Exporter:
+    ext = os.path.splitext(filename)[1].lstrip(".").lower()
+    if ext == "markdown":
+        ext = "md"
+    if ext == "htm":
+        ext = "html"
+    if ext not in exporters:
+        raise ValueError("unknown export format: {}".format(ext))
+    return exporters[ext](images, images_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export records from a saved workspace")
+    parser.add_argument("output", help="target file, format is taken from the extension (jsonl, csv, md, html)")
+    parser.add_argument("--workspace", help="pickled workspace, defaults to the active one")
+    parser.add_argument("--record", help="export only the record with this name")
+    parser.add_argument("--images", choices=[IMAGES_COPY, IMAGES_EMBED])
+    parser.add_argument("--images-dir")
+    args = parser.parse_args()
+
+    # image and workspace paths are relative to the app folder, like in the gui
+    args.output = os.path.abspath(args.output)
+    if args.workspace:
+        args.workspace = os.path.abspath(args.workspace)
+    if args.images_dir:
+        args.images_dir = os.path.abspath(args.images_dir)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.workspace:
+        with open(args.workspace, "rb") as f:
+            workspace = pickle.load(f)
+    else:
+        try:
+            workspace = WorkspaceManager().read()
+        except FileNotFoundError as e:
+            parser.error(str(e))
+    target = workspace
+    if args.record is not None:
+        target = next((x for x in workspace.records if x.name == args.record), None)
+        if target is None:
+            parser.error("no record named {!r} in {}".format(args.record, workspace.name))
+    exporterForFile(args.output, args.images, args.images_dir).export(target, args.output)
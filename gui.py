@@ -1,23 +1,40 @@
 import sys
 from types import LambdaType
-from PyQt5.QtWidgets import QApplication, QGridLayout, QLabel, QLayout, QListWidget, QListWidgetItem, QPushButton, QScrollArea, QWidget, QComboBox, QVBoxLayout, QSpacerItem, QSizePolicy, QCheckBox, QLineEdit, QHBoxLayout, QPlainTextEdit, QProgressBar, QListView, QInputDialog, QTextEdit
-from PyQt5.QtGui import QIcon, QTextLine, QStandardItem, QStandardItemModel, QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication, QGridLayout, QLabel, QLayout, QListWidget, QListWidgetItem, QPushButton, QScrollArea, QWidget, QComboBox, QVBoxLayout, QSpacerItem, QSizePolicy, QCheckBox, QLineEdit, QHBoxLayout, QPlainTextEdit, QProgressBar, QListView, QInputDialog, QTextEdit, QFileDialog, QShortcut, QMessageBox
+from PyQt5.QtGui import QIcon, QTextLine, QStandardItem, QStandardItemModel, QPainter, QPixmap, QKeySequence
 from PyQt5.QtCore import QRectF, QSize, Qt
 from PyQt5.QtSvg import QSvgWidget, QSvgRenderer
-from PyQt5.QtCore import QObject, pyqtSignal
-import pickle
+from PyQt5.QtCore import QObject, pyqtSignal, QThread, QByteArray
 
 from oracles import *
+from workspaces import WorkspaceManager
+from exporter import exporters, exporterForFile, IMAGES_NONE, IMAGES_COPY, IMAGES_EMBED
 import glob
 
 import os
 os.chdir(os.path.dirname(__file__))
 
+class ExportThread(QThread):
+    def __init__(self, exporter, target, filename: str):
+        super().__init__()
+        self.exporter = exporter
+        self.target = target
+        self.filename = filename
+        self.error = None
+
+    def run(self):
+        try:
+            self.exporter.export(self.target, self.filename)
+        except Exception as e:
+            self.error = str(e)
+
+
 class App(QWidget):
     update = pyqtSignal()
     def __init__(self):
         super().__init__()
         self.title = 'Oracle Manager'
+        self.exportThreads = []
         self.left = 200
         self.top = 200
         self.width = 1300
@@ -37,21 +54,16 @@ class App(QWidget):
         for file in glob.glob(os.path.join(os.getcwd(), "oracles", "*.json")):
             oracle = self.builder.buildFromFile(file)
             self.oracles.append(oracle)
+        for file in glob.glob(os.path.join(os.getcwd(), "packs", "*.orp")):
+            self.oracles += self.builder.buildFromPack(file)
             
-        try:
-            if not os.path.isfile('workspace.pickle'):
-                raise Exception("no workspace file")
-            with open('workspace.pickle', 'rb') as f:
-                self.workspace = pickle.load(f)
-                self.workspace.update()
-        except:
-            self.workspace = Workspace("Oracles")
-            self.workspace.addNewRecord("Values")
-            self.workspace.selectedRecord = 0
+        self.manager = WorkspaceManager()
+        self.workspace = self.manager.load()
     
     def connectSignals(self):
         self.update.connect(self.updateWorkspaceWidget)
-        pass
+        QShortcut(QKeySequence.Undo, self).activated.connect(self.undo)
+        QShortcut(QKeySequence.Redo, self).activated.connect(self.redo)
     
     def oneLine(self, a: QWidget, b: QWidget, a_s: int = 1, b_s: int = 1) -> QWidget:
         fl = QHBoxLayout()
@@ -73,6 +85,43 @@ class App(QWidget):
         return b
 
         
+    def textButton(self, text: str) -> QWidget:
+        b = QPushButton(text)
+        b.setFixedHeight(36)
+        return b
+
+    def exportDialog(self, target, name: str):
+        filters = ";;".join("{} (*.{})".format(ext.upper(), ext) for ext in exporters)
+        filename, _ = QFileDialog.getSaveFileName(self, "Export", name + ".md", filters)
+        if not filename:
+            return
+        modes = ["No images", "Copy images", "Embed images"]
+        mode, okPressed = QInputDialog.getItem(self, "Export", "Images", modes, 0, False)
+        if not okPressed:
+            return
+        images = [IMAGES_NONE, IMAGES_COPY, IMAGES_EMBED][modes.index(mode)]
+        try:
+            exporter = exporterForFile(filename, images)
+        except ValueError as e:
+            QMessageBox.warning(self, "Export", str(e))
+            return
+        # large records are written in the background so the UI stays responsive,
+        # running threads are kept referenced until they finish
+        thread = ExportThread(exporter, target, filename)
+        thread.finished.connect(lambda: self.exportFinished(thread))
+        self.exportThreads.append(thread)
+        self.setWindowTitle("{} - exporting...".format(self.title))
+        thread.start()
+
+    def exportFinished(self, thread: ExportThread):
+        self.exportThreads.remove(thread)
+        if not self.exportThreads:
+            self.setWindowTitle(self.title)
+        if thread.error:
+            QMessageBox.critical(self, "Export", "Export to {} failed: {}".format(thread.filename, thread.error))
+        else:
+            QMessageBox.information(self, "Export", "Exported to {}".format(thread.filename))
+
     def oraclesSelectWidget(self) -> QWidget:
         self.oraclesList = QComboBox()
         for oracle in self.oracles:
@@ -177,6 +226,9 @@ class App(QWidget):
         cb.clicked.connect(lambda: self.clearRecord(record))
         rmb = self.iconButton("remove")
         rmb.clicked.connect(lambda: self.removeRecord(record))
+        eb = self.textButton("Export")
+        eb.clicked.connect(lambda: self.exportDialog(record, record.name))
+        buttons.layout().addWidget(eb)
         buttons.layout().addWidget(rb)
         buttons.layout().addWidget(cb)
         buttons.layout().addWidget(rmb)
@@ -210,8 +262,14 @@ class App(QWidget):
         record.returnValue(value)
         self.updateWorkspaceWidget()
         
-    def copyImage(self, image):
-        QApplication.clipboard().setPixmap(QPixmap(image))
+    def copyImage(self, value: Value):
+        if value.oracle.pack:
+            # packs keep the full size image next to the thumbnail, read it only here
+            pixmap = QPixmap()
+            pixmap.loadFromData(value.getImageData(full=True))
+        else:
+            pixmap = QPixmap(value.getImage())
+        QApplication.clipboard().setPixmap(pixmap)
 
     def valueWidget(self, record: Record, value: Value) -> QWidget:
         w = self.hLayout()
@@ -222,18 +280,32 @@ class App(QWidget):
 
         image = value.getImage()
         image_width = 150
+        if image and value.oracle.pack:
+            # pack images are read from the mmapped pack only when displayed
+            data = value.getImageData()
+            if data is None:
+                image = ""
         if image and image.endswith(".svg"):
-            widget = QSvgWidget(value.getImage())
+            widget = QSvgWidget()
+            if value.oracle.pack:
+                widget.load(QByteArray(data))
+            else:
+                widget.load(image)
             # image_width = widget.renderer().viewBox().width()
         elif image:
             widget = QPushButton("")
             widget.setFlat(True)
-            pixmap = QPixmap(image).scaledToHeight(image_width)
+            if value.oracle.pack:
+                pixmap = QPixmap()
+                pixmap.loadFromData(data)
+            else:
+                pixmap = QPixmap(image)
+            pixmap = pixmap.scaledToHeight(image_width)
             # widget.setPixmap(pixmap)
             widget.setIcon(QIcon(pixmap))
             widget.setIconSize(QSize(image_width, 200))
             w.layout().setContentsMargins(24, 6, 6, 6)
-            widget.clicked.connect(lambda: self.copyImage(image))
+            widget.clicked.connect(lambda: self.copyImage(value))
         if image:
             widget.setFixedHeight(180)
             widget.setFixedWidth(image_width)
@@ -356,6 +428,10 @@ class App(QWidget):
         self.updateWorkspaceWidget()
 
     def updateWorkspaceWidget(self):
+        # every action ends here, so this is where undo snapshots are taken,
+        # before the undo and redo buttons read the history
+        self.workspace.history.commit(self.workspace)
+
         layout = self._workspaceWidget.layout()
         self.clearWidget(self._workspaceWidget)
 
@@ -364,6 +440,8 @@ class App(QWidget):
         layout.addWidget(left, 2)
         layout.addWidget(right, 3)
 
+        left.layout().addWidget(self.workspacesWidget())
+
         name = QLabel("<b style='font-size: 24px'>{}</b>".format(self.workspace.name))
         buttons = self.toolbar()
         left.layout().addWidget(self.oneLine(name, buttons))
@@ -384,6 +462,19 @@ class App(QWidget):
         rb = self.iconButton("rename")
         rb.clicked.connect(lambda: self.renameWorkspace(self.workspace))
 
+        eb = self.textButton("Export")
+        eb.clicked.connect(lambda: self.exportDialog(self.workspace, self.workspace.name))
+
+        ub = self.textButton("Undo")
+        ub.setEnabled(self.workspace.history.canUndo())
+        ub.clicked.connect(self.undo)
+        reb = self.textButton("Redo")
+        reb.setEnabled(self.workspace.history.canRedo())
+        reb.clicked.connect(self.redo)
+
+        buttons.layout().addWidget(ub)
+        buttons.layout().addWidget(reb)
+        buttons.layout().addWidget(eb)
         buttons.layout().addWidget(addButton)
         buttons.layout().addWidget(upb)
         buttons.layout().addWidget(rb)
@@ -422,9 +513,58 @@ class App(QWidget):
         left.layout().addItem(QSpacerItem(
             20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
             
-        with open('workspace.pickle', 'wb') as f:
-            pickle.dump(self.workspace, f)
+        self.manager.save()
             
+    def workspacesWidget(self) -> QWidget:
+        self.workspacesList = QComboBox()
+        keys = []
+        for key, name in self.manager.names():
+            keys.append(key)
+            self.workspacesList.addItem(name)
+        self.workspacesList.setCurrentIndex(keys.index(self.manager.active()))
+        self.workspacesList.activated.connect(lambda i: self.switchWorkspace(keys[i]))
+
+        buttons = self.hLayout()
+        addButton = self.iconButton("plus")
+        addButton.clicked.connect(self.addWorkspace)
+        buttons.layout().addWidget(addButton)
+        if len(keys) > 1:
+            rmb = self.iconButton("remove")
+            rmb.clicked.connect(lambda: self.removeWorkspace(self.manager.active()))
+            buttons.layout().addWidget(rmb)
+        return self.oneLine(self.workspacesList, buttons, 3, 1)
+
+    def switchWorkspace(self, key: str):
+        try:
+            self.workspace = self.manager.switch(key)
+        except Exception as e:
+            QMessageBox.warning(self, "Switch workspace", "Can't open workspace: {}".format(e))
+        self.updateWorkspaceWidget()
+
+    def addWorkspace(self):
+        text, okPressed = QInputDialog.getText(
+            self, "New workspace", "Workspace name", QLineEdit.Normal, "")
+        if not okPressed or not text:
+            return
+        self.workspace = self.manager.create(text)
+        self.updateWorkspaceWidget()
+
+    def removeWorkspace(self, key: str):
+        answer = QMessageBox.question(
+            self, "Remove workspace", "Remove workspace \"{}\"?".format(self.workspace.name))
+        if answer != QMessageBox.Yes:
+            return
+        self.workspace = self.manager.remove(key)
+        self.updateWorkspaceWidget()
+
+    def undo(self):
+        if self.workspace.history.undo(self.workspace):
+            self.updateWorkspaceWidget()
+
+    def redo(self):
+        if self.workspace.history.redo(self.workspace):
+            self.updateWorkspaceWidget()
+
     def updateRecordsWidget(self):
         for n, record in enumerate(self.workspace.records):
             item = QListWidgetItem("{} [{}]".format(record.name, len(record.values)))
@@ -447,7 +587,7 @@ class App(QWidget):
     def clearRecord(self, record: Record):
         for value in record.values:
             value.returnValue()
-        record.values = []
+        record.values.clear()
         self.updateWorkspaceWidget()
     def removeRecord(self, record: Record):
         for value in record.values:
@@ -481,6 +621,8 @@ class App(QWidget):
 
         
         self.show()
+        for error in self.manager.errors:
+            QMessageBox.warning(self, "Workspaces", error)
         
 
 if __name__ == '__main__':
@@ -3,12 +3,46 @@ import random
 import json
 import os
 
-sources = json.load(open("sources.json", "r"))
+from packs import openPack
+
+sources = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sources.json"), "r"))
+
+def counted(method):
+    def wrapper(self, *args, **kwargs):
+        self.revision += 1
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TrackedList(list):
+    # counts its modifications, so undo snapshots can skip decks and records
+    # that did not change since the last one
+    revision = 0
+
+    append = counted(list.append)
+    extend = counted(list.extend)
+    insert = counted(list.insert)
+    remove = counted(list.remove)
+    pop = counted(list.pop)
+    clear = counted(list.clear)
+    sort = counted(list.sort)
+    reverse = counted(list.reverse)
+    __setitem__ = counted(list.__setitem__)
+    __delitem__ = counted(list.__delitem__)
+    __iadd__ = counted(list.__iadd__)
+    __imul__ = counted(list.__imul__)
+
+
+def tracked(values: list) -> TrackedList:
+    if isinstance(values, TrackedList):
+        return values
+    return TrackedList(values)
+
 
 class Source:
     def __init__(self, name: str, values: list, finite: bool = False) -> None:
         self.name = name
-        self.values = values
+        self.values = tracked(values)
         self.total = len(values)
         self.finite = finite
         self.shuffled = False
@@ -53,12 +87,20 @@ class SourceBuilder:
         return source
     
 class Value:
+    # number of state changes, undo snapshots re-read states only when it moved
+    changes = 0
+
     def __init__(self, oracle, id, state) -> None:
         self.oracle = oracle
         self.id = id
         self.state = state
         self.update()
 
+    def __setattr__(self, name, value):
+        if name == "state" and "state" in self.__dict__:
+            Value.changes += 1
+        super().__setattr__(name, value)
+
     def update(self):
         try:
             self.data = next(x for x in self.oracle.spec["values"] if (
@@ -82,6 +124,8 @@ class Value:
         self.oracle.source.returnValue(self.id)
         
     def getImage(self):
+        if self.oracle.pack:
+            return self.oracle.pack.getImageKey(self.oracle.pack_name, self.id)
         images = ""
         if self.oracle.source.images:
             images = self.oracle.source.images
@@ -90,10 +134,25 @@ class Value:
         if images:
             images = images.format(name=self.getName(), id=self.id, data=self.data)
         return images
+
+    def getImageData(self, full: bool = False) -> bytes:
+        image = self.getImage()
+        if not image:
+            return None
+        if self.oracle.pack:
+            return self.oracle.pack.getImage(image, full)
+        if not os.path.isfile(image):
+            return None
+        with open(image, "rb") as f:
+            return f.read()
         
 
 
 class Oracle:
+    # class defaults keep workspaces pickled before packs loadable
+    pack = None
+    pack_name = None
+
     def __init__(self, source: Source, spec: dict) -> None:
         self.source = source
         self.spec = spec
@@ -147,9 +206,17 @@ class OracleBuilder:
     def __init__(self) -> None:
         self.builder = SourceBuilder()
 
-    def build(self, spec: dict) -> Oracle:
-        source = self.builder.build(sources[spec["source"]])
-        return Oracle(source, spec)
+    def build(self, spec: dict, pack=None) -> Oracle:
+        if pack:
+            source = self.builder.build(pack.sources[spec["source"]])
+        else:
+            source = self.builder.build(sources[spec["source"]])
+        oracle = Oracle(source, spec)
+        if pack:
+            oracle.pack = pack
+            oracle.pack_name = spec["name"]
+            oracle.path = pack.path
+        return oracle
     
     def buildFromFile(self, filename: str) -> Oracle:
         with open(filename, 'r') as f:
@@ -157,9 +224,16 @@ class OracleBuilder:
         oracle = self.build(spec)
         oracle.path = filename
         return oracle
+
+    def buildFromPack(self, filename: str) -> list:
+        pack = openPack(filename)
+        return [self.build(pack.getSpec(name), pack) for name in pack.getOracleNames()]
     
     def update(self, oracle: Oracle):
-        new_oracle = self.buildFromFile(oracle.path)
+        if oracle.pack:
+            new_oracle = self.build(oracle.pack.getSpec(oracle.pack_name), oracle.pack)
+        else:
+            new_oracle = self.buildFromFile(oracle.path)
         oracle.source.images = new_oracle.source.images
         oracle.spec = new_oracle.spec
         oracle.update()
@@ -167,7 +241,7 @@ class OracleBuilder:
 class Record:
     def __init__(self, name: str) -> None:
         self.name = name
-        self.values = []
+        self.values = TrackedList()
         
     def add(self, value: Value):
         self.values.append(value)
@@ -189,9 +263,15 @@ class Workspace:
         self.oracles = []
         self.records = []
         self.builder = OracleBuilder()
+
+    def __getstate__(self):
+        # undo history lives in memory only, saving it would grow every save
+        state = self.__dict__.copy()
+        state.pop("history", None)
+        return state
         
     def addNewOracle(self, oracle: Oracle) -> None:
-        new_oracle = self.builder.build(oracle.spec)
+        new_oracle = self.builder.build(oracle.spec, oracle.pack)
         new_oracle.path = oracle.path
         self.oracles.append(new_oracle)
         
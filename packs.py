@@ -0,0 +1,224 @@
+import typing
+import json
+import struct
+import mmap
+import os
+import glob
+import shutil
+import tempfile
+import argparse
+
+MAGIC = b"ORPK"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+
+# Pack layout:
+#   header   MAGIC, format version, size of the table of contents
+#   toc      utf-8 JSON: {"sources": [offset, length],
+#                         "oracles": {name: {"spec": [offset, length],
+#                                            "source": source name,
+#                                            "index": {value id or name: image key}}},
+#                         "images": {image key: [offset, length]},
+#                         "originals": {image key: [offset, length]}}
+#   data     blobs, offsets are relative to the end of the toc
+#
+# The toc is the only part parsed on open; specs and images are sliced out
+# of the memory map when they are actually needed. "images" are the scaled
+# thumbnails, "originals" only has the images that were scaled down.
+
+PACKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "packs")
+
+_packs = {}
+
+
+def openPack(path: str) -> "Pack":
+    path = os.path.abspath(path)
+    if path not in _packs:
+        _packs[path] = Pack(path)
+    return _packs[path]
+
+
+def findPack(name: str) -> "Pack":
+    # workspaces refer to packs relative to the packs folder, so the app
+    # folder can be moved
+    path = os.path.join(PACKS, name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError("oracle pack {} is missing from {}".format(name, PACKS))
+    return openPack(path)
+
+
+class Pack:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, toc_size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not an oracle pack".format(path))
+        if version != VERSION:
+            raise ValueError("unsupported pack version {} in {}".format(version, path))
+        self.start = HEADER.size + toc_size
+        self.toc = json.loads(self.data[HEADER.size:self.start].decode("utf-8"))
+        self._sources = None
+
+    def __reduce__(self):
+        # workspaces are pickled with their oracles, keep only the location
+        return (findPack, (os.path.relpath(self.path, PACKS),))
+
+    def read(self, entry: list) -> bytes:
+        offset, length = entry
+        return self.data[self.start + offset:self.start + offset + length]
+
+    @property
+    def sources(self) -> dict:
+        if self._sources is None:
+            self._sources = json.loads(self.read(self.toc["sources"]).decode("utf-8"))
+        return self._sources
+
+    def getOracleNames(self) -> list:
+        return list(self.toc["oracles"])
+
+    def getSpec(self, name: str) -> dict:
+        if name not in self.toc["oracles"]:
+            raise ValueError("oracle pack {} has no oracle {!r}".format(self.path, name))
+        return json.loads(self.read(self.toc["oracles"][name]["spec"]).decode("utf-8"))
+
+    def getImageKey(self, name: str, id) -> str:
+        if name not in self.toc["oracles"]:
+            return ""
+        return self.toc["oracles"][name]["index"].get(str(id), "")
+
+    def getImage(self, key: str, full: bool = False) -> bytes:
+        if full and key in self.toc.get("originals", {}):
+            return self.read(self.toc["originals"][key])
+        if key not in self.toc["images"]:
+            return None
+        return self.read(self.toc["images"][key])
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+        _packs.pop(self.path, None)
+
+
+def findFile(path: str) -> str:
+    # image templates don't always match the case of the files on disk
+    if os.path.isfile(path):
+        return path
+    folder = os.path.dirname(path) or "."
+    if not os.path.isdir(folder):
+        return None
+    name = os.path.basename(path).lower()
+    for file in os.listdir(folder):
+        if file.lower() == name:
+            return os.path.join(folder, file)
+    return None
+
+
+FORMATS = {".png": "PNG", ".jpg": "JPG", ".jpeg": "JPG"}
+
+
+def scaleImage(filename: str, height: int) -> bytes:
+    # only formats we can write back under the same extension are scaled
+    fmt = FORMATS.get(os.path.splitext(filename)[1].lower())
+    if not fmt:
+        return None
+    from PyQt5.QtGui import QImage
+    from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, Qt
+    image = QImage(filename)
+    if image.isNull() or image.height() <= height:
+        return None
+    image = image.scaledToHeight(height, Qt.SmoothTransformation)
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, fmt)
+    return bytes(data)
+
+
+class PackBuilder:
+    def __init__(self, height: int = 150) -> None:
+        self.height = height
+        self.scale = True
+        try:
+            import PyQt5.QtGui
+        except ImportError:
+            print("PyQt5 is not available, images are stored without scaling")
+            self.scale = False
+
+    def build(self, filename: str, sources: dict, oracle_files: list) -> None:
+        from oracles import SourceBuilder, Oracle, Value
+        builder = SourceBuilder()
+        toc = {"oracles": {}, "images": {}, "originals": {}}
+        used_sources = {}
+        with tempfile.TemporaryFile() as blobs:
+            def write(data: bytes) -> list:
+                offset = blobs.tell()
+                blobs.write(data)
+                return [offset, len(data)]
+
+            for oracle_file in oracle_files:
+                with open(oracle_file, "r") as f:
+                    spec = json.load(f)
+                name = spec.setdefault("name", os.path.splitext(os.path.basename(oracle_file))[0])
+                if name in toc["oracles"]:
+                    raise ValueError("{}: oracle name {!r} is already used by another file".format(oracle_file, name))
+                oracle = Oracle(builder.build(sources[spec["source"]]), spec)
+                used_sources[spec["source"]] = sources[spec["source"]]
+                index = {}
+                known = set()
+                for x in spec["values"]:
+                    known.update([x.get("id"), x.get("name")])
+                for id in oracle.source.values:
+                    if id not in known:
+                        continue
+                    value = Value(oracle, id, None)
+                    image = findFile(value.getImage()) if value.getImage() else None
+                    if not image:
+                        continue
+                    key = value.getImage()
+                    if key not in toc["images"]:
+                        with open(image, "rb") as f:
+                            original = f.read()
+                        data = None
+                        if self.scale:
+                            data = scaleImage(image, self.height)
+                        if data is None:
+                            toc["images"][key] = write(original)
+                        else:
+                            toc["images"][key] = write(data)
+                            toc["originals"][key] = write(original)
+                    index[str(id)] = key
+                    index[str(value.getName())] = key
+                toc["oracles"][name] = {
+                    "spec": write(json.dumps(spec).encode("utf-8")),
+                    "source": spec["source"],
+                    "index": index,
+                }
+            toc["sources"] = write(json.dumps(used_sources).encode("utf-8"))
+
+            toc_data = json.dumps(toc).encode("utf-8")
+            if os.path.dirname(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(toc_data)))
+                f.write(toc_data)
+                blobs.seek(0)
+                shutil.copyfileobj(blobs, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a single-file oracle pack from sources.json, oracles/ and images/")
+    parser.add_argument("output", help="pack file, e.g. packs/default.orp")
+    parser.add_argument("oracles", nargs="*", help="oracle json files, defaults to oracles/*.json")
+    parser.add_argument("--sources", default="sources.json")
+    parser.add_argument("--height", type=int, default=150, help="images are scaled down to this height")
+    args = parser.parse_args()
+
+    with open(args.sources, "r") as f:
+        sources = json.load(f)
+    oracle_files = args.oracles or sorted(glob.glob(os.path.join("oracles", "*.json")))
+    try:
+        PackBuilder(args.height).build(args.output, sources, oracle_files)
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,360 @@
+import typing
+import json
+import os
+import pickle
+import re
+import operator
+
+from oracles import *
+
+
+# Snapshots store decks and records as trees of tuples. Chunk boundaries
+# depend on the items themselves, not on their positions, so a pick from
+# the top of a deck, an append or a removal only replaces the chunk it
+# touched and the path to the root; every other chunk is shared with the
+# previous snapshot.
+MAX_CHUNK = 64
+
+
+def isBoundary(item) -> bool:
+    # about one item in 16 ends a chunk
+    return ((id(item) >> 4) * 2654435761) & 0xf0000000 == 0
+
+
+def chunks(items: list) -> list:
+    bounds = []
+    start = 0
+    for i, item in enumerate(items):
+        size = i + 1 - start
+        if (size > 1 and isBoundary(item)) or size >= MAX_CHUNK:
+            bounds.append((start, i + 1))
+            start = i + 1
+    if start < len(items):
+        bounds.append((start, len(items)))
+    return bounds
+
+
+class Leaf(tuple):
+    states = None
+
+
+def walk(node: tuple) -> typing.Iterator[tuple]:
+    yield node
+    if not isinstance(node, Leaf):
+        for child in node:
+            yield from walk(child)
+
+
+def leaves(node: tuple) -> typing.Iterator[Leaf]:
+    return (x for x in walk(node) if isinstance(x, Leaf))
+
+
+def same(a, b) -> bool:
+    return len(a) == len(b) and all(map(operator.is_, a, b))
+
+
+def freezeList(items: list, previous: tuple = None, states: bool = False) -> tuple:
+    known = {}
+    if previous is not None:
+        for node in walk(previous):
+            if node:
+                known[(isinstance(node, Leaf), id(node[0]), len(node))] = node
+
+    level = []
+    for start, end in chunks(items):
+        part = items[start:end]
+        part_states = tuple(x.state for x in part) if states else None
+        node = known.get((True, id(part[0]), len(part)))
+        if node is None or not same(node, part) or node.states != part_states:
+            node = Leaf(part)
+            node.states = part_states
+        level.append(node)
+    if not level:
+        node = Leaf()
+        node.states = () if states else None
+        return node
+
+    while len(level) > 1:
+        parent = []
+        for start, end in chunks(level):
+            part = level[start:end]
+            node = known.get((False, id(part[0]), len(part)))
+            if node is None or not same(node, part):
+                node = tuple(part)
+            parent.append(node)
+        level = parent
+    return level[0]
+
+
+def share(new: tuple, old: tuple) -> tuple:
+    # reuse the previous tuple when it holds the same objects
+    if old is not None and same(new, old):
+        return old
+    return new
+
+
+class History:
+    def __init__(self, limit: int = 100) -> None:
+        self.limit = limit
+        self.snapshots = []
+        self.position = -1
+        # owner (record or oracle) -> (live list, its revision, tree, oracles)
+        self.seen = {}
+        self.changes = None
+
+    def current(self) -> tuple:
+        if self.position < 0:
+            return None
+        return self.snapshots[self.position]
+
+    def isFresh(self, owner, values: list, states: bool = False) -> bool:
+        seen = self.seen.get(owner)
+        if not seen or seen[0] is not values or not isinstance(values, TrackedList):
+            return False
+        if states and self.changes != Value.changes:
+            return False
+        return seen[1] == values.revision
+
+    def freezeValues(self, owner, values: list, states: bool = False) -> tuple:
+        # decks and records that did not change keep their tree, changed ones
+        # get a new tree that shares every untouched chunk
+        if self.isFresh(owner, values, states):
+            return self.seen[owner][2]
+        seen = self.seen.get(owner)
+        tree = freezeList(values, seen[2] if seen else None, states)
+        oracles = frozenset(x.oracle for x in values) if states else None
+        self.seen[owner] = (values, getattr(values, "revision", None), tree, oracles)
+        return tree
+
+    def freeze(self, workspace: Workspace) -> tuple:
+        previous = self.current()
+        prev_records = {}
+        prev_sources = {}
+        if previous:
+            prev_records = {x[0]: x for x in previous[3]}
+            prev_sources = previous[4]
+
+        records = []
+        oracles = dict.fromkeys(workspace.oracles)
+        for record in workspace.records:
+            tree = self.freezeValues(record, record.values, True)
+            oracles.update(dict.fromkeys(self.seen[record][3]))
+            records.append(share((record, record.name, tree), prev_records.get(record)))
+        self.changes = Value.changes
+
+        sources = {}
+        for oracle in oracles:
+            tree = self.freezeValues(oracle, oracle.source.values)
+            sources[oracle] = share((tree, oracle.source.shuffled), prev_sources.get(oracle))
+        if sources.keys() == prev_sources.keys() and same(list(sources.values()), list(prev_sources.values())):
+            sources = prev_sources
+
+        oracles = tuple(workspace.oracles)
+        records = tuple(records)
+        if previous:
+            oracles = share(oracles, previous[2])
+            records = share(records, previous[3])
+        return (workspace.name, getattr(workspace, "selectedRecord", 0), oracles, records, sources)
+
+    def commit(self, workspace: Workspace) -> bool:
+        snapshot = self.freeze(workspace)
+        previous = self.current()
+        if previous and snapshot[:2] == previous[:2] and same(snapshot[2:], previous[2:]):
+            return False
+        del self.snapshots[self.position + 1:]
+        self.snapshots.append(snapshot)
+        if len(self.snapshots) > self.limit:
+            del self.snapshots[0]
+        self.position = len(self.snapshots) - 1
+        return True
+
+    def thaw(self, owner, values: list, tree: tuple, states: bool = False) -> list:
+        # only lists whose tree differs from the live one are rebuilt
+        seen = self.seen.get(owner)
+        if seen and seen[2] is tree and self.isFresh(owner, values, states):
+            return values
+        values = TrackedList(x for leaf in leaves(tree) for x in leaf)
+        if states:
+            for leaf in leaves(tree):
+                for value, state in zip(leaf, leaf.states):
+                    value.state = state
+        oracles = frozenset(x.oracle for x in values) if states else None
+        self.seen[owner] = (values, values.revision, tree, oracles)
+        return values
+
+    def restore(self, workspace: Workspace, snapshot: tuple) -> None:
+        name, selected, oracles, records, sources = snapshot
+        clean = self.changes == Value.changes
+        workspace.name = name
+        workspace.oracles = list(oracles)
+        workspace.records = []
+        for record, record_name, tree in records:
+            record.name = record_name
+            record.values = self.thaw(record, record.values, tree, True)
+            workspace.records.append(record)
+        for oracle, (tree, shuffled) in sources.items():
+            oracle.source.values = self.thaw(oracle, oracle.source.values, tree)
+            oracle.source.shuffled = shuffled
+        if clean:
+            # the states set above are the snapshot's own
+            self.changes = Value.changes
+        workspace.selectedRecord = min(selected, len(workspace.records) - 1)
+
+    def canUndo(self) -> bool:
+        return self.position > 0
+
+    def canRedo(self) -> bool:
+        return self.position < len(self.snapshots) - 1
+
+    def undo(self, workspace: Workspace) -> bool:
+        if not self.canUndo():
+            return False
+        self.position -= 1
+        self.restore(workspace, self.snapshots[self.position])
+        return True
+
+    def redo(self, workspace: Workspace) -> bool:
+        if not self.canRedo():
+            return False
+        self.position += 1
+        self.restore(workspace, self.snapshots[self.position])
+        return True
+
+
+class WorkspaceManager:
+    def __init__(self, folder: str = "workspaces") -> None:
+        self.folder = folder
+        self.index_file = os.path.join(folder, "index.json")
+        self.index = {"active": None, "workspaces": {}}
+        self.workspace = None
+        self.errors = []
+
+    def load(self) -> Workspace:
+        os.makedirs(self.folder, exist_ok=True)
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, "r") as f:
+                self.index = json.load(f)
+        elif os.path.isfile("workspace.pickle"):
+            # move the single workspace of older versions into the folder
+            key = self.newKey("workspace")
+            os.replace("workspace.pickle", self.filename(key))
+            self.index["workspaces"][key] = key
+            self.index["active"] = key
+        # start with the active workspace and fall back to the others, a new
+        # one is only created when none of them can be opened
+        keys = list(self.index["workspaces"])
+        if self.index["active"] in keys:
+            keys.remove(self.index["active"])
+            keys.insert(0, self.index["active"])
+        for key in keys:
+            try:
+                self.open(key)
+                self.workspace.update()
+                return self.workspace
+            except Exception as e:
+                self.workspace = None
+                self.errors.append("Can't open workspace \"{}\": {}".format(self.index["workspaces"][key], e))
+        return self.create("Oracles")
+
+    def read(self, key: str = None) -> Workspace:
+        # read-only access for tools, nothing on disk is changed
+        index = self.index
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+        if key is None:
+            key = index["active"]
+        if key is not None:
+            filename = self.filename(key)
+        elif os.path.isfile("workspace.pickle"):
+            filename = "workspace.pickle"
+        else:
+            raise FileNotFoundError("no saved workspaces in {}".format(self.folder))
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+
+    def filename(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".pickle")
+
+    def newKey(self, name: str) -> str:
+        base = re.sub(r"[^\w-]+", "_", name).strip("_").lower() or "workspace"
+        key = base
+        n = 1
+        while key in self.index["workspaces"] or os.path.isfile(self.filename(key)):
+            n += 1
+            key = "{}_{}".format(base, n)
+        return key
+
+    def names(self) -> list:
+        return list(self.index["workspaces"].items())
+
+    def active(self) -> str:
+        return self.index["active"]
+
+    def open(self, key: str) -> Workspace:
+        with open(self.filename(key), "rb") as f:
+            workspace = pickle.load(f)
+        # workspaces saved before undo support hold plain lists
+        for record in workspace.records:
+            record.values = tracked(record.values)
+            for value in record.values:
+                value.oracle.source.values = tracked(value.oracle.source.values)
+        for oracle in workspace.oracles:
+            oracle.source.values = tracked(oracle.source.values)
+        if not hasattr(workspace, "history"):
+            workspace.history = History()
+        if not hasattr(workspace, "selectedRecord"):
+            workspace.selectedRecord = 0
+        self.workspace = workspace
+        self.index["active"] = key
+        workspace.history.commit(workspace)
+        self.saveIndex()
+        return workspace
+
+    def create(self, name: str) -> Workspace:
+        if self.workspace:
+            self.save()
+        key = self.newKey(name)
+        workspace = Workspace(name)
+        workspace.addNewRecord("Values")
+        workspace.selectedRecord = 0
+        workspace.history = History()
+        workspace.history.commit(workspace)
+        self.workspace = workspace
+        self.index["workspaces"][key] = name
+        self.index["active"] = key
+        self.save()
+        return workspace
+
+    def switch(self, key: str) -> Workspace:
+        # the oracle catalog is kept by the caller, only the pickle is read.
+        # If the pickle can't be loaded the current workspace stays active.
+        if key == self.index["active"]:
+            return self.workspace
+        self.save()
+        return self.open(key)
+
+    def remove(self, key: str) -> Workspace:
+        if key == self.index["active"]:
+            self.workspace = None
+        del self.index["workspaces"][key]
+        # keep the file around, a removed campaign can still be recovered by hand
+        if os.path.isfile(self.filename(key)):
+            os.replace(self.filename(key), self.filename(key) + ".deleted")
+        if self.workspace:
+            self.saveIndex()
+            return self.workspace
+        if self.index["workspaces"]:
+            return self.open(next(iter(self.index["workspaces"])))
+        return self.create("Oracles")
+
+    def save(self) -> None:
+        key = self.index["active"]
+        self.index["workspaces"][key] = self.workspace.name
+        with open(self.filename(key), "wb") as f:
+            pickle.dump(self.workspace, f)
+        self.saveIndex()
+
+    def saveIndex(self) -> None:
+        with open(self.index_file, "w") as f:
+            json.dump(self.index, f, indent=4)